@@ -10,8 +10,12 @@ This addon runs on the runner HOST (not inside VMs) and:
 5. For SNI-only mode: Passes through or blocks without decryption
 6. Logs network activity per-run to JSONL files
 """
+import collections
+import concurrent.futures
 import os
 import json
+import queue
+import threading
 import time
 import urllib.parse
 import ipaddress
@@ -19,13 +23,40 @@ import socket
 from mitmproxy import http, ctx, tls
 from mitmproxy.addonmanager import Loader
 
+# orjson is markedly faster for the registry/logging hot paths; fall back
+# to stdlib json where it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # Vercel bypass secret (still from environment as it's a secret)
 VERCEL_BYPASS = os.environ.get("VERCEL_AUTOMATION_BYPASS_SECRET", "")
 
+# Trusted storage domains that skip the MITM rewrite - S3 presigned URLs
+# have signatures that break when proxied. Matched with one C-level
+# endswith over a tuple instead of a per-request Python loop. Regional S3
+# endpoints (bucket.s3-<region>.amazonaws.com) are checked separately,
+# anchored to .amazonaws.com so the ".s3-" pattern can't match
+# unrelated hosts that merely contain it.
+_TRUSTED_STORAGE_SUFFIXES = (
+    "s3.amazonaws.com",
+    "r2.cloudflarestorage.com",
+    "storage.googleapis.com",
+)
+
+
+def _is_trusted_storage(hostname: str) -> bool:
+    """True when hostname is a trusted storage endpoint (expects lowercase)."""
+    if hostname.endswith(_TRUSTED_STORAGE_SUFFIXES):
+        return True
+    return ".s3-" in hostname and hostname.endswith(".amazonaws.com")
+
 
 def load(loader: Loader) -> None:
     """Register custom options for the addon."""
+    _start_log_writer()
     loader.add_option(
         name="vm0_api_url",
         typespec=str,
@@ -40,26 +71,64 @@ def load(loader: Loader) -> None:
     )
 
 
-def get_api_url() -> str:
-    """Get API URL from options."""
-    return ctx.options.vm0_api_url
-
-
 def get_registry_path() -> str:
     """Get registry path from options."""
     return ctx.options.vm0_proxy_registry_path
 
 
-def get_proxy_url() -> str:
-    """Construct proxy URL from API URL."""
-    return f"{get_api_url()}/api/webhooks/agent/proxy"
+# URL config parsed once when options change (see configure) instead of
+# re-running urlparse/lower per request and per ClientHello. Scalars are
+# extracted eagerly because SplitResult.hostname re-parses the netloc on
+# every attribute access.
+_api_url = ""
+_api_hostname = ""
+_proxy_host = ""
+_proxy_scheme = ""
+_proxy_port = 443
+_proxy_path = ""
+
+
+def configure(updated: set) -> None:
+    """Recompute cached URL config when options change."""
+    global _api_url, _api_hostname, _proxy_host, _proxy_scheme, _proxy_port, _proxy_path
+    if "vm0_api_url" in updated:
+        _api_url = ctx.options.vm0_api_url
+        parsed_api = urllib.parse.urlparse(_api_url)
+        _api_hostname = parsed_api.hostname.lower() if parsed_api.hostname else ""
+        parsed = urllib.parse.urlparse(f"{_api_url}/api/webhooks/agent/proxy")
+        _proxy_host = parsed.hostname or ""
+        _proxy_scheme = parsed.scheme
+        _proxy_port = 443 if parsed.scheme == "https" else 80
+        _proxy_path = parsed.path
+
+
+def _proxy_path_prefix(vm_info: dict, run_id: str) -> str:
+    """
+    Per-VM rewrite path prefix, cached on the vm_info dict so the runId
+    is quoted once per VM instead of urlencoded per request. The cache
+    entry carries the API URL it was built against, so an option change
+    invalidates it; registry reloads produce fresh dicts anyway.
+    """
+    cached = vm_info.get("_proxyPathPrefix")
+    if cached is not None and cached[0] == _api_url:
+        return cached[1]
+    if run_id:
+        prefix = f"{_proxy_path}?runId={urllib.parse.quote(run_id, safe='')}&url="
+    else:
+        prefix = f"{_proxy_path}?url="
+    vm_info["_proxyPathPrefix"] = (_api_url, prefix)
+    return prefix
 
-# Cache for proxy registry (invalidated by file stat change)
+# Cache for proxy registry (invalidated by file stat change; st_ino is
+# included so atomic rename-over updates are detected)
 _registry_cache = {}
-_registry_cache_key = (0, 0)
+_registry_cache_key = (0, 0, 0)
 
-# Track request start times for latency calculation
-request_start_times = {}
+# Track request start times (monotonic ns) for latency calculation.
+# LRU-bounded so flows that never reach response()/error() can't grow it
+# forever over the runner's lifetime.
+REQUEST_START_TIMES_MAX = 50_000
+request_start_times: collections.OrderedDict = collections.OrderedDict()
 
 
 def load_registry() -> dict:
@@ -69,12 +138,19 @@ def load_registry() -> dict:
     try:
         registry_path = get_registry_path()
         st = os.stat(registry_path)
-        key = (st.st_mtime_ns, st.st_size)
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
         if key == _registry_cache_key:
             return _registry_cache
-        with open(registry_path, "r") as f:
-            _registry_cache = json.load(f).get("vms", {})
-            _registry_cache_key = key
+        with open(registry_path, "rb") as f:
+            data = f.read()
+        loads = orjson.loads if orjson else json.loads
+        _registry_cache = loads(data).get("vms", {})
+        _registry_cache_key = key
+        _compiled_rules_cache.clear()
+        _rule_decision_cache.clear()
+        _close_stale_log_fds(
+            {vm.get("networkLogPath") for vm in _registry_cache.values()}
+        )
     except Exception as e:
         ctx.log.warn(f"Failed to load proxy registry: {e}")
 
@@ -87,19 +163,119 @@ def get_vm_info(client_ip: str) -> dict | None:
     return registry.get(client_ip)
 
 
+# Network-log writer: hooks only serialize the entry and enqueue it; a
+# dedicated daemon thread blocks on the queue, drains whatever has
+# accumulated, groups it by networkLogPath, and writes one batch per path.
+# This keeps all file I/O off the mitmproxy event-loop thread.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_writer_started = False
+
+# Open FDs cached per networkLogPath for the lifetime of the run, so each
+# flush is a single writev instead of open+write+close. Stale FDs are closed
+# when their VM leaves the registry (see load_registry).
+_log_fds: dict[str, int] = {}
+_log_fds_lock = threading.Lock()
+
+
+def _log_fd_for(path: str) -> int:
+    """Get (lazily opening) the cached append FD for a log path."""
+    with _log_fds_lock:
+        fd = _log_fds.get(path)
+        if fd is None:
+            fd = os.open(
+                path,
+                os.O_CREAT | os.O_APPEND | os.O_WRONLY | os.O_CLOEXEC,
+                0o644,
+            )
+            _log_fds[path] = fd
+        return fd
+
+
+def _close_stale_log_fds(active_paths: set) -> None:
+    """Close cached FDs for paths whose VM is no longer registered."""
+    with _log_fds_lock:
+        for path in [p for p in _log_fds if p not in active_paths]:
+            try:
+                os.close(_log_fds.pop(path))
+            except OSError:
+                pass
+
+
+def _drain_log_queue() -> list[tuple[str, bytes]]:
+    """Take everything currently queued without blocking."""
+    items = []
+    try:
+        while True:
+            items.append(_log_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return items
+
+
+# writev fails with EINVAL past IOV_MAX buffers per call; large drains
+# (notably the shutdown flush) are chunked to stay under it
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (OSError, ValueError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+
+def _write_log_batch(items: list[tuple[str, bytes]]) -> None:
+    """Group queued lines by path and write each group with one writev."""
+    by_path: dict[str, list[bytes]] = {}
+    for log_path, line in items:
+        by_path.setdefault(log_path, []).append(line)
+    for log_path, lines in by_path.items():
+        try:
+            fd = _log_fd_for(log_path)
+            for i in range(0, len(lines), _IOV_MAX):
+                os.writev(fd, lines[i : i + _IOV_MAX])
+        except Exception as e:
+            ctx.log.warn(f"Failed to write network log: {e}")
+
+
+def _log_writer_loop() -> None:
+    while True:
+        # Block for the first entry, then batch whatever else arrived
+        items = [_log_queue.get()]
+        items.extend(_drain_log_queue())
+        _write_log_batch(items)
+
+
+def _start_log_writer() -> None:
+    global _log_writer_started
+    if _log_writer_started:
+        return
+    _log_writer_started = True
+    threading.Thread(target=_log_writer_loop, daemon=True).start()
+
+
+# Log timestamps have 1s resolution, so format at most once per second
+# instead of running strftime/gmtime for every entry.
+_ts_cache = [0, ""]
+
+
+def _now_iso() -> str:
+    """Current UTC time as YYYY-MM-DDTHH:MM:SS, cached per second."""
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache[0] = t
+        _ts_cache[1] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t))
+    return _ts_cache[1]
+
+
 def log_network_entry(vm_info: dict, entry: dict) -> None:
-    """Write a network log entry to the per-run JSONL file."""
+    """Queue a network log entry for the per-run JSONL file."""
     log_path = vm_info.get("networkLogPath")
     if not log_path:
         return
-    try:
-        fd = os.open(log_path, os.O_CREAT | os.O_APPEND | os.O_WRONLY, 0o644)
-        try:
-            os.write(fd, (json.dumps(entry) + "\n").encode())
-        finally:
-            os.close(fd)
-    except Exception as e:
-        ctx.log.warn(f"Failed to write network log: {e}")
+    if orjson:
+        line = orjson.dumps(entry) + b"\n"
+    else:
+        line = (json.dumps(entry) + "\n").encode()
+    _log_queue.put_nowait((log_path, line))
 
 
 def get_original_url(flow: http.HTTPFlow) -> str:
@@ -121,52 +297,175 @@ def get_original_url(flow: http.HTTPFlow) -> str:
 # Firewall Rule Matching
 # ============================================================================
 
-def match_domain(pattern: str, hostname: str) -> bool:
-    """
-    Match hostname against domain pattern.
-    Supports exact match and wildcard prefix (*.example.com).
-    """
-    if not pattern or not hostname:
-        return False
-
-    pattern = pattern.lower()
-    hostname = hostname.lower()
-
-    if pattern.startswith("*."):
-        # Wildcard: *.example.com matches sub.example.com, www.example.com
-        # Also matches example.com itself (without subdomain)
-        suffix = pattern[1:]  # .example.com
-        base = pattern[2:]    # example.com
-        return hostname.endswith(suffix) or hostname == base
+# DNS results cached with a TTL so CIDR-rule evaluation doesn't block the
+# mitmproxy event loop on repeat lookups. Expired entries are refreshed in a
+# worker thread while the stale value keeps serving; only the very first
+# lookup for a hostname resolves synchronously. Hostnames come from
+# guest-controlled SNI/request hosts, so the cache is LRU-bounded like the
+# decision cache rather than growing for the runner's lifetime.
+DNS_TTL = 60.0  # seconds
+DNS_NEGATIVE_TTL = 10.0  # seconds
+DNS_CACHE_MAX = 4096
+_dns_cache: collections.OrderedDict = collections.OrderedDict()
+_dns_refreshing: set[str] = set()
+_dns_lock = threading.Lock()
+_dns_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="mitm-dns"
+)
+
+
+def _resolve_ip(hostname: str) -> str | None:
+    try:
+        return socket.getaddrinfo(
+            hostname, None, family=socket.AF_INET, type=socket.SOCK_STREAM
+        )[0][4][0]
+    except (socket.gaierror, IndexError):
+        return None
 
-    return hostname == pattern
 
+def _dns_store(hostname: str, ip: str | None) -> None:
+    expiry = time.time() + (DNS_TTL if ip else DNS_NEGATIVE_TTL)
+    with _dns_lock:
+        _dns_cache[hostname] = (expiry, ip)
+        _dns_cache.move_to_end(hostname)
+        if len(_dns_cache) > DNS_CACHE_MAX:
+            _dns_cache.popitem(last=False)
+        _dns_refreshing.discard(hostname)
 
-def match_ip(cidr: str, ip_str: str) -> bool:
-    """
-    Match IP address against CIDR range.
-    Supports single IPs (1.2.3.4) and ranges (10.0.0.0/8).
-    """
-    if not cidr or not ip_str:
-        return False
 
-    try:
-        # Parse CIDR (automatically handles single IPs as /32)
-        if "/" not in cidr:
-            cidr = f"{cidr}/32"
-        network = ipaddress.ip_network(cidr, strict=False)
-        ip = ipaddress.ip_address(ip_str)
-        return ip in network
-    except ValueError:
-        return False
+def _dns_refresh(hostname: str) -> None:
+    _dns_store(hostname, _resolve_ip(hostname))
 
 
 def resolve_hostname_to_ip(hostname: str) -> str | None:
-    """Resolve hostname to IP address for IP-based rule matching."""
-    try:
-        return socket.gethostbyname(hostname)
-    except socket.gaierror:
-        return None
+    """Resolve hostname to IP address for IP-based rule matching (TTL-cached)."""
+    now = time.time()
+    with _dns_lock:
+        cached = _dns_cache.get(hostname)
+        if cached is not None:
+            _dns_cache.move_to_end(hostname)
+            if now < cached[0] or hostname in _dns_refreshing:
+                return cached[1]
+            _dns_refreshing.add(hostname)
+    if cached is not None:
+        # Expired: serve the stale value while a worker refreshes it
+        _dns_executor.submit(_dns_refresh, hostname)
+        return cached[1]
+    ip = _resolve_ip(hostname)
+    _dns_store(hostname, ip)
+    return ip
+
+
+# Compiled rule structures, keyed by id(rules). The registry cache owns the
+# rule lists, so entries stay valid until the registry reloads, which clears
+# this cache (see load_registry).
+_compiled_rules_cache: dict[int, dict] = {}
+
+
+def _compile_rules(rules: list) -> dict:
+    """
+    Compile a rule list into an indexed structure for fast lookup.
+
+    - Exact domain rules and single-host IP rules go into hash indexes
+      ("easy" bucket) probed in O(1) before anything else.
+    - Wildcard domain rules go into a reversed-label trie ("*" terminals),
+      making matching O(labels) instead of O(rules) with no per-request
+      lowercasing of patterns.
+    - CIDR IP rules are parsed to ip_network objects once, not per request.
+    - First-match-wins order is preserved by tagging every entry with
+      its rule index and taking the lowest-index candidate at lookup time.
+    """
+    compiled = _compiled_rules_cache.get(id(rules))
+    if compiled is not None:
+        return compiled
+
+    exact_domains: dict = {}
+    exact_ips: dict = {}
+    trie: dict = {}
+    final = None
+    ip4_rules = []
+    ip6_rules = []
+    first_ip_idx = len(rules)
+
+    for idx, rule in enumerate(rules):
+        # Final/terminal rule - value is the action
+        final_action = rule.get("final")
+        if final_action:
+            if final is None:
+                final = (idx, final_action, "final")
+            continue
+
+        # Domain rule: exact match or wildcard prefix (*.example.com).
+        # Wildcards match subdomains and the base domain itself.
+        # A rule may carry both domain and ip (the schema doesn't forbid
+        # it), in which case both halves are indexed under the same idx.
+        domain = rule.get("domain")
+        if domain:
+            pattern = domain.lower()
+            entry = (idx, rule.get("action", "DENY"), f"domain:{domain}")
+            if pattern.startswith("*."):
+                node = trie
+                for label in reversed(pattern[2:].split(".")):
+                    node = node.setdefault(label, {})
+                if "*" not in node:
+                    node["*"] = entry
+            elif pattern not in exact_domains:
+                exact_domains[pattern] = entry
+
+        # IP rule: single IP (1.2.3.4) or CIDR range (10.0.0.0/8)
+        ip_pattern = rule.get("ip")
+        if ip_pattern:
+            cidr = ip_pattern if "/" in ip_pattern else f"{ip_pattern}/32"
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                continue
+            entry = (idx, rule.get("action", "DENY"), f"ip:{ip_pattern}")
+            first_ip_idx = min(first_ip_idx, idx)
+            if network.prefixlen == network.max_prefixlen:
+                key = str(network.network_address)
+                if key not in exact_ips:
+                    exact_ips[key] = entry
+            elif network.version == 4:
+                # IPv4 CIDRs become (net, mask) ints so matching is a
+                # single AND+compare with no ipaddress objects
+                ip4_rules.append(
+                    (idx, int(network.network_address), int(network.netmask),
+                     entry[1], entry[2])
+                )
+            else:
+                ip6_rules.append((idx, network, entry[1], entry[2]))
+
+    compiled = {
+        "exact_domains": exact_domains,
+        "exact_ips": exact_ips,
+        "trie": trie,
+        "final": final,
+        "ip4_rules": ip4_rules,
+        "ip6_rules": ip6_rules,
+        "first_ip_idx": first_ip_idx,
+    }
+    _compiled_rules_cache[id(rules)] = compiled
+    return compiled
+
+
+def _match_trie(trie: dict, hostname: str) -> tuple | None:
+    """
+    Walk the reversed-label trie for hostname and return the lowest-index
+    wildcard terminal hit, or None if no wildcard rule matches.
+    """
+    best = None
+    node = trie
+    for label in reversed(hostname.split(".")):
+        child = node.get(label)
+        if not isinstance(child, dict):
+            return best
+        node = child
+        # Wildcard terminal matches here and any deeper subdomain
+        terminal = node.get("*")
+        if terminal and (best is None or terminal[0] < best[0]):
+            best = terminal
+    return best
 
 
 def evaluate_rules(rules: list, hostname: str, ip_str: str = None) -> tuple[str, str | None]:
@@ -174,7 +473,12 @@ def evaluate_rules(rules: list, hostname: str, ip_str: str = None) -> tuple[str,
     Evaluate firewall rules against hostname/IP.
     Returns (action, matched_rule_description).
 
-    Rule evaluation is first-match-wins (top to bottom).
+    `hostname` must already be lowercased (the hooks lower it once on
+    entry); compiled patterns are lowered at compile time, so no string
+    allocation happens here.
+
+    Rule evaluation is first-match-wins (top to bottom), computed against
+    the compiled structure from _compile_rules rather than a linear scan.
 
     Rule formats:
     - Domain/IP rule: { domain: "*.example.com", action: "ALLOW" }
@@ -183,30 +487,87 @@ def evaluate_rules(rules: list, hostname: str, ip_str: str = None) -> tuple[str,
     if not rules:
         return ("ALLOW", None)  # No rules = allow all
 
-    for rule in rules:
-        # Final/terminal rule - value is the action
-        final_action = rule.get("final")
-        if final_action:
-            return (final_action, "final")
-
-        # Domain rule
-        domain = rule.get("domain")
-        if domain and match_domain(domain, hostname):
-            return (rule.get("action", "DENY"), f"domain:{domain}")
-
-        # IP rule
-        ip_pattern = rule.get("ip")
-        if ip_pattern:
-            target_ip = ip_str
-            if not target_ip:
-                target_ip = resolve_hostname_to_ip(hostname)
-            if target_ip and match_ip(ip_pattern, target_ip):
-                return (rule.get("action", "DENY"), f"ip:{ip_pattern}")
+    compiled = _compile_rules(rules)
+
+    # Easy bucket first: O(1) exact-domain probe
+    best = compiled["exact_domains"].get(hostname)
+
+    wildcard = _match_trie(compiled["trie"], hostname)
+    if wildcard and (best is None or wildcard[0] < best[0]):
+        best = wildcard
+
+    final = compiled["final"]
+    if final and (best is None or final[0] < best[0]):
+        best = final
+
+    # Only resolve/check IPs when an IP rule precedes the best match so far
+    best_idx = best[0] if best else len(rules)
+    if compiled["first_ip_idx"] < best_idx:
+        target_ip = ip_str or resolve_hostname_to_ip(hostname)
+        if target_ip:
+            exact = compiled["exact_ips"].get(target_ip)
+            if exact and exact[0] < best_idx:
+                best = exact
+                best_idx = exact[0]
+            ip4_rules = compiled["ip4_rules"]
+            ip6_rules = compiled["ip6_rules"]
+            if ip4_rules or ip6_rules:
+                # IPv4 hot path: one AND+compare per CIDR, no ipaddress objects
+                try:
+                    ip_int = int.from_bytes(socket.inet_aton(target_ip), "big")
+                except OSError:
+                    ip_int = None
+                if ip_int is not None:
+                    for idx, net, mask, action, desc in ip4_rules:
+                        if idx >= best_idx:
+                            break
+                        if (ip_int & mask) == net:
+                            best = (idx, action, desc)
+                            break
+                elif ip6_rules:
+                    try:
+                        ip = ipaddress.ip_address(target_ip)
+                    except ValueError:
+                        ip = None
+                    if ip is not None:
+                        for idx, network, action, desc in ip6_rules:
+                            if idx >= best_idx:
+                                break
+                            if ip.version == network.version and ip in network:
+                                best = (idx, action, desc)
+                                break
+
+    if best:
+        return (best[1], best[2])
 
     # No rule matched - default deny (zero-trust)
     return ("DENY", "default")
 
 
+# Memoized decisions for hot hostnames (package registries, API endpoints
+# hit thousands of times per run). Keyed by registry version + client so a
+# registry reload naturally invalidates; LRU-bounded to cap memory.
+RULE_DECISION_CACHE_MAX = 1024
+_rule_decision_cache: collections.OrderedDict = collections.OrderedDict()
+
+
+def evaluate_rules_cached(rules: list, client_ip: str, hostname: str) -> tuple[str, str | None]:
+    """
+    Evaluate rules with an LRU cache over (registry version, VM, hostname).
+    `hostname` must already be lowercased so cache keys stay canonical.
+    """
+    key = (_registry_cache_key, client_ip, hostname)
+    decision = _rule_decision_cache.get(key)
+    if decision is not None:
+        _rule_decision_cache.move_to_end(key)
+        return decision
+    decision = evaluate_rules(rules, hostname)
+    _rule_decision_cache[key] = decision
+    if len(_rule_decision_cache) > RULE_DECISION_CACHE_MAX:
+        _rule_decision_cache.popitem(last=False)
+    return decision
+
+
 # ============================================================================
 # TLS ClientHello Handler (SNI-only mode)
 # ============================================================================
@@ -231,21 +592,18 @@ def tls_clienthello(data: tls.ClientHelloData) -> None:
     if vm_info.get("mitmEnabled", False):
         return
 
-    # SNI-only mode: check rules based on SNI
+    # SNI-only mode: check rules based on SNI (lowercased once here)
     sni = data.context.client.sni
+    sni = sni.lower() if sni else None
     run_id = vm_info.get("runId", "")
     rules = vm_info.get("firewallRules", [])
 
     # Auto-allow VM0 API requests - the agent MUST be able to communicate with VM0
-    api_url = get_api_url()
-    if api_url and sni:
-        parsed_api = urllib.parse.urlparse(api_url)
-        api_hostname = parsed_api.hostname.lower() if parsed_api.hostname else ""
-        sni_lower = sni.lower()
-        if api_hostname and (sni_lower == api_hostname or sni_lower.endswith(f".{api_hostname}")):
+    if _api_hostname and sni:
+        if sni == _api_hostname or sni.endswith(f".{_api_hostname}"):
             ctx.log.info(f"[{run_id}] SNI-only auto-allow VM0 API: {sni}")
             log_network_entry(vm_info, {
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                "timestamp": _now_iso(),
                 "mode": "sni",
                 "action": "ALLOW",
                 "host": sni,
@@ -259,7 +617,7 @@ def tls_clienthello(data: tls.ClientHelloData) -> None:
         # No SNI, can't determine target - block for security
         ctx.log.warn(f"[{run_id}] SNI-only: No SNI in ClientHello, blocking")
         log_network_entry(vm_info, {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            "timestamp": _now_iso(),
             "mode": "sni",
             "action": "DENY",
             "host": "",
@@ -271,11 +629,11 @@ def tls_clienthello(data: tls.ClientHelloData) -> None:
         return
 
     # Evaluate rules
-    action, matched_rule = evaluate_rules(rules, sni)
+    action, matched_rule = evaluate_rules_cached(rules, client_ip, sni)
 
     # Log the connection
     log_network_entry(vm_info, {
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        "timestamp": _now_iso(),
         "mode": "sni",
         "action": action,
         "host": sni,
@@ -306,7 +664,10 @@ def request(flow: http.HTTPFlow) -> None:
     For MITM mode, rewrites allowed requests to VM0 Proxy.
     """
     # Track request start time
-    request_start_times[flow.id] = time.time()
+    request_start_times[flow.id] = time.monotonic_ns()
+    request_start_times.move_to_end(flow.id)
+    if len(request_start_times) > REQUEST_START_TIMES_MAX:
+        request_start_times.popitem(last=False)
 
     # Get client IP (source VM)
     client_ip = flow.client_conn.peername[0] if flow.client_conn.peername else None
@@ -339,11 +700,8 @@ def request(flow: http.HTTPFlow) -> None:
 
     # Auto-allow VM0 API requests - the agent MUST be able to communicate with VM0
     # This is checked before user firewall rules to ensure agent functionality
-    api_url = get_api_url()
-    if api_url:
-        parsed_api = urllib.parse.urlparse(api_url)
-        api_hostname = parsed_api.hostname.lower() if parsed_api.hostname else ""
-        if api_hostname and (hostname == api_hostname or hostname.endswith(f".{api_hostname}")):
+    if _api_hostname:
+        if hostname == _api_hostname or hostname.endswith(f".{_api_hostname}"):
             ctx.log.info(f"[{run_id}] Auto-allow VM0 API: {hostname}")
             flow.metadata["firewall_action"] = "ALLOW"
             flow.metadata["firewall_rule"] = "vm0-api"
@@ -353,7 +711,7 @@ def request(flow: http.HTTPFlow) -> None:
             return
 
     # Evaluate firewall rules
-    action, matched_rule = evaluate_rules(rules, hostname)
+    action, matched_rule = evaluate_rules_cached(rules, client_ip, hostname)
     flow.metadata["firewall_action"] = action
     flow.metadata["firewall_rule"] = matched_rule
 
@@ -370,31 +728,22 @@ def request(flow: http.HTTPFlow) -> None:
     # Request is ALLOWED - proceed with processing
 
     # Skip if no API URL configured
-    if not api_url:
+    if not _api_url:
         ctx.log.warn("vm0_api_url not set, passing through")
         return
 
     # Skip rewriting requests already going to VM0 (avoid loops)
-    if api_url in flow.request.pretty_url:
+    if _api_url in flow.request.pretty_url:
         flow.metadata["original_url"] = flow.request.pretty_url
         flow.metadata["skip_rewrite"] = True
         return
 
     # Skip rewriting requests to trusted storage domains (S3, etc.)
-    # S3 presigned URLs have signatures that break when proxied
-    TRUSTED_DOMAINS = [
-        ".s3.amazonaws.com",
-        ".s3-",  # Regional S3 endpoints like s3-us-west-2.amazonaws.com
-        "s3.amazonaws.com",
-        ".r2.cloudflarestorage.com",
-        ".storage.googleapis.com",
-    ]
-    for domain in TRUSTED_DOMAINS:
-        if domain in hostname or hostname.endswith(domain.lstrip(".")):
-            ctx.log.info(f"[{run_id}] Skipping trusted storage domain: {hostname}")
-            flow.metadata["original_url"] = get_original_url(flow)
-            flow.metadata["skip_rewrite"] = True
-            return
+    if _is_trusted_storage(hostname):
+        ctx.log.info(f"[{run_id}] Skipping trusted storage domain: {hostname}")
+        flow.metadata["original_url"] = get_original_url(flow)
+        flow.metadata["skip_rewrite"] = True
+        return
 
     # Get original target URL
     original_url = get_original_url(flow)
@@ -408,20 +757,14 @@ def request(flow: http.HTTPFlow) -> None:
     # MITM mode: rewrite to VM0 Proxy
     ctx.log.info(f"[{run_id}] Proxying via MITM: {original_url}")
 
-    # Parse proxy URL
-    parsed = urllib.parse.urlparse(get_proxy_url())
-
-    # Build query params
-    query_params = {"url": original_url}
-    if run_id:
-        query_params["runId"] = run_id
-    query_string = urllib.parse.urlencode(query_params)
-
-    # Rewrite request to proxy
-    flow.request.host = parsed.hostname
-    flow.request.port = 443 if parsed.scheme == "https" else 80
-    flow.request.scheme = parsed.scheme
-    flow.request.path = f"{parsed.path}?{query_string}"
+    # Rewrite request to proxy; host/port/scheme and the runId query
+    # prefix are precomputed, so only the target URL is quoted here
+    flow.request.host = _proxy_host
+    flow.request.port = _proxy_port
+    flow.request.scheme = _proxy_scheme
+    flow.request.path = _proxy_path_prefix(vm_info, run_id) + urllib.parse.quote(
+        original_url, safe=""
+    )
 
     # Save original Authorization header before overwriting
     if "Authorization" in flow.request.headers:
@@ -436,13 +779,32 @@ def request(flow: http.HTTPFlow) -> None:
         flow.request.headers["x-vercel-protection-bypass"] = VERCEL_BYPASS
 
 
+def _message_size(msg: http.Message) -> int:
+    """
+    Byte size of a request/response body for logging, without forcing
+    mitmproxy to assemble and decode the full content.
+
+    Trusts Content-Length when present (a lying peer can skew the logged
+    size, which is acceptable for activity logging); otherwise falls back
+    to the raw body length, skipping the content-encoding decode that
+    .content performs.
+    """
+    content_length = msg.headers.get("content-length")
+    if content_length and "chunked" not in msg.headers.get("transfer-encoding", "").lower():
+        try:
+            return int(content_length)
+        except ValueError:
+            pass
+    return len(msg.raw_content or b"")
+
+
 def response(flow: http.HTTPFlow) -> None:
     """
     Handle response and log network activity.
     """
     # Calculate latency
     start_time = request_start_times.pop(flow.id, None)
-    latency_ms = int((time.time() - start_time) * 1000) if start_time else 0
+    latency_ms = (time.monotonic_ns() - start_time) // 1_000_000 if start_time else 0
 
     # Get stored info
     run_id = flow.metadata.get("vm_run_id", "")
@@ -452,8 +814,8 @@ def response(flow: http.HTTPFlow) -> None:
     firewall_rule = flow.metadata.get("firewall_rule")
 
     # Calculate sizes
-    request_size = len(flow.request.content) if flow.request.content else 0
-    response_size = len(flow.response.content) if flow.response and flow.response.content else 0
+    request_size = _message_size(flow.request)
+    response_size = _message_size(flow.response) if flow.response else 0
     status_code = flow.response.status_code if flow.response else 0
 
     # Parse URL for host
@@ -469,7 +831,7 @@ def response(flow: http.HTTPFlow) -> None:
     network_log_path = flow.metadata.get("vm_network_log_path", "")
     if run_id and network_log_path:
         log_entry = {
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            "timestamp": _now_iso(),
             "mode": "mitm" if mitm_enabled else "sni",
             "action": firewall_action,
             "host": host,
@@ -506,5 +868,11 @@ def error(flow: http.HTTPFlow) -> None:
     request_start_times.pop(flow.id, None)
 
 
+def done() -> None:
+    """Flush any queued network log entries on addon shutdown."""
+    _write_log_batch(_drain_log_queue())
+    _close_stale_log_fds(set())
+
+
 # mitmproxy addon registration
-addons = [tls_clienthello, request, response, error]
+addons = [configure, tls_clienthello, request, response, error, done]
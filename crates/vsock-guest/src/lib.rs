@@ -30,6 +30,12 @@ static SHUTDOWN_RECEIVED: AtomicBool = AtomicBool::new(false);
 #[cfg(target_os = "linux")]
 const VSOCK_CID_HOST: u32 = 2;
 
+/// Kernel socket buffer size requested for the vsock connection (only used
+/// on Linux). The vsock defaults are small enough to stall bursty
+/// exec_result payloads; 4MB comfortably covers the capped output size.
+#[cfg(target_os = "linux")]
+const SOCKET_BUF_SIZE: libc::c_int = 4 * 1024 * 1024;
+
 /// Read buffer size for the connection event loop (local tuning constant).
 const READ_BUFFER_SIZE: usize = 64 * 1024; // 64KB
 
@@ -39,6 +45,15 @@ const EXIT_CODE_TIMEOUT: i32 = 124;
 /// Maximum length for command preview in logs
 const COMMAND_PREVIEW_MAX_LEN: usize = 100;
 
+/// Maximum bytes captured per output stream (stdout/stderr) of a command.
+///
+/// Keeps a chatty build script from pinning guest memory, and keeps the
+/// exec_result payload well under the protocol's MAX_MESSAGE_SIZE (16MB).
+const OUTPUT_CAPTURE_CAP: usize = 4 * 1024 * 1024;
+
+/// Marker appended to captured output when it exceeds the cap.
+const OUTPUT_TRUNCATED_MARKER: &[u8] = b"\n[output truncated]\n";
+
 /// Convert a ProtocolError to an io::Error
 fn to_io_error(e: ProtocolError) -> io::Error {
     io::Error::new(io::ErrorKind::InvalidData, e.to_string())
@@ -157,9 +172,82 @@ fn extract_exit_code(status: ExitStatus) -> i32 {
     status.code().unwrap_or(1)
 }
 
+/// Numeric rank for a log level name (lower = more severe).
+fn level_rank(level: &str) -> u8 {
+    match level {
+        "ERROR" => 0,
+        "WARN" => 1,
+        _ => 2,
+    }
+}
+
+/// Minimum level written to stderr, read once from `VSOCK_GUEST_LOG`
+/// (`error`, `warn`, or `info`; default `info`). Lets operators silence the
+/// per-message INFO logs that dominate per-message cost under ping floods.
+fn log_threshold() -> u8 {
+    use std::sync::OnceLock;
+    static THRESHOLD: OnceLock<u8> = OnceLock::new();
+    *THRESHOLD.get_or_init(|| match std::env::var("VSOCK_GUEST_LOG").as_deref() {
+        Ok("error") => 0,
+        Ok("warn") => 1,
+        _ => 2,
+    })
+}
+
 /// Log a message to stderr
 pub fn log(level: &str, msg: &str) {
-    eprintln!("[vsock-guest] [{level}] {msg}");
+    if level_rank(level) > log_threshold() {
+        return;
+    }
+    // Format the whole line first so the locked stderr handle gets a single
+    // write instead of one per format fragment (eprintln's behavior).
+    let line = format!("[vsock-guest] [{level}] {msg}\n");
+    let _ = io::stderr().lock().write_all(line.as_bytes());
+}
+
+/// Read a child output pipe to completion, keeping at most `OUTPUT_CAPTURE_CAP`
+/// bytes. Excess output is still drained (so the child never blocks on a full
+/// pipe) but discarded, and a truncation marker is appended.
+fn read_capped<R: Read>(mut pipe: R) -> Vec<u8> {
+    let mut captured = Vec::new();
+    let mut buf = [0u8; 8192];
+    let mut truncated = false;
+    loop {
+        match pipe.read(&mut buf) {
+            Ok(0) => break,
+            Ok(n) => {
+                let remaining = OUTPUT_CAPTURE_CAP.saturating_sub(captured.len());
+                let take = n.min(remaining);
+                // take <= n <= buf.len() is guaranteed above
+                captured.extend_from_slice(buf.get(..take).unwrap_or_default());
+                if take < n {
+                    truncated = true;
+                }
+            }
+            Err(_) => break,
+        }
+    }
+    if truncated {
+        captured.extend_from_slice(OUTPUT_TRUNCATED_MARKER);
+    }
+    captured
+}
+
+/// Collect a child's stdout/stderr with the capture cap, then reap it.
+/// Bounded replacement for `Child::wait_with_output`.
+fn wait_with_capped_output(mut child: Child) -> io::Result<(ExitStatus, Vec<u8>, Vec<u8>)> {
+    // Read stderr on a separate thread so neither pipe can fill and deadlock
+    // the child while we drain the other.
+    let stderr_thread = child
+        .stderr
+        .take()
+        .map(|pipe| thread::spawn(move || read_capped(pipe)));
+    let stdout = child.stdout.take().map(read_capped).unwrap_or_default();
+    let stderr = stderr_thread
+        .map(|t| t.join().unwrap_or_default())
+        .unwrap_or_default();
+    let status = child.wait()?;
+    Ok((status, stdout, stderr))
 }
 
 /// Run a child process with timeout. Returns (exit_code, stdout, stderr).
@@ -195,22 +283,18 @@ fn wait_with_timeout(child: Child, timeout_ms: u32) -> (i32, Vec<u8>, Vec<u8>) {
     });
 
     // Wait for the process to complete
-    let output = child.wait_with_output();
+    let output = wait_with_capped_output(child);
 
     // Signal that process completed (killer thread will exit)
     let _ = tx.send(());
 
     match output {
-        Ok(output) => {
+        Ok((status, stdout, stderr)) => {
             // Check if process was killed by OUR timeout (not external SIGKILL)
             if killed_by_timeout.load(Ordering::SeqCst) {
-                return (EXIT_CODE_TIMEOUT, output.stdout, b"Timeout".to_vec());
+                return (EXIT_CODE_TIMEOUT, stdout, b"Timeout".to_vec());
             }
-            (
-                extract_exit_code(output.status),
-                output.stdout,
-                output.stderr,
-            )
+            (extract_exit_code(status), stdout, stderr)
         }
         Err(e) => (1, Vec::new(), format!("Failed to wait: {}", e).into_bytes()),
     }
@@ -401,13 +485,9 @@ fn handle_spawn_watch(
                 let result = if timeout_ms > 0 {
                     wait_with_timeout(child, timeout_ms)
                 } else {
-                    // No timeout - wait indefinitely
-                    match child.wait_with_output() {
-                        Ok(output) => (
-                            extract_exit_code(output.status),
-                            output.stdout,
-                            output.stderr,
-                        ),
+                    // No timeout - wait indefinitely (output still capped)
+                    match wait_with_capped_output(child) {
+                        Ok((status, stdout, stderr)) => (extract_exit_code(status), stdout, stderr),
                         Err(e) => (1, Vec::new(), format!("Failed to wait: {}", e).into_bytes()),
                     }
                 };
@@ -452,10 +532,46 @@ fn handle_spawn_watch(
     }
 }
 
+/// Handle exec message in a background thread.
+///
+/// Runs the blocking subprocess wait off the event loop so pings, shutdown,
+/// and further commands stay responsive during a long-running exec. The
+/// result is sent via the shared writer, same as `handle_spawn_watch`'s exit
+/// notification.
+fn handle_exec_async(
+    timeout_ms: u32,
+    command: String,
+    env: Vec<(String, String)>,
+    sudo: bool,
+    seq: u32,
+    writer: Arc<Mutex<UnixStream>>,
+) {
+    thread::spawn(move || {
+        let env_refs: Vec<(&str, &str)> =
+            env.iter().map(|(k, v)| (k.as_str(), v.as_str())).collect();
+        let (exit_code, stdout, stderr) = handle_exec(timeout_ms, &command, &env_refs, sudo);
+        let payload = vsock_proto::encode_exec_result(exit_code, &stdout, &stderr);
+        let response = match vsock_proto::encode(MSG_EXEC_RESULT, seq, &payload) {
+            Ok(msg) => msg,
+            Err(e) => {
+                log("ERROR", &format!("Failed to encode exec_result: {}", e));
+                return;
+            }
+        };
+        // Recover from poisoned mutex: a panicked thread shouldn't prevent
+        // us from sending the exec result on a best-effort basis.
+        let mut w = writer.lock().unwrap_or_else(|e| e.into_inner());
+        if let Err(e) = w.write_all(&response) {
+            log("ERROR", &format!("Failed to send exec_result: {}", e));
+        }
+    });
+}
+
 /// Handle incoming message and return response.
 ///
-/// `MSG_SPAWN_WATCH` is handled separately in `handle_connection` because it
-/// needs the writer `Arc` for background process-exit notifications.
+/// `MSG_SPAWN_WATCH` and `MSG_EXEC` are handled separately in
+/// `handle_connection` because they need the writer `Arc` to send results
+/// from background threads.
 fn handle_message(msg: &RawMessage) -> io::Result<Option<Vec<u8>>> {
     log(
         "INFO",
@@ -463,16 +579,13 @@ fn handle_message(msg: &RawMessage) -> io::Result<Option<Vec<u8>>> {
     );
 
     match msg.msg_type {
-        MSG_PING => Ok(Some(
-            vsock_proto::encode(MSG_PONG, msg.seq, &[]).map_err(to_io_error)?,
-        )),
-        MSG_EXEC => {
-            let d = vsock_proto::decode_exec(&msg.payload).map_err(to_io_error)?;
-            let (exit_code, stdout, stderr) = handle_exec(d.timeout_ms, d.command, &d.env, d.sudo);
-            let payload = vsock_proto::encode_exec_result(exit_code, &stdout, &stderr);
-            Ok(Some(
-                vsock_proto::encode(MSG_EXEC_RESULT, msg.seq, &payload).map_err(to_io_error)?,
-            ))
+        MSG_PING => {
+            // Highest-frequency message: pong is a fixed 9-byte frame
+            // (length=5, type, seq), so patch the seq into a stack template
+            // instead of going through encode()'s Vec building
+            let mut pong = [0u8, 0, 0, 5, MSG_PONG, 0, 0, 0, 0];
+            pong[5..9].copy_from_slice(&msg.seq.to_be_bytes());
+            Ok(Some(pong.to_vec()))
         }
         MSG_WRITE_FILE => {
             let (path, content, use_sudo) =
@@ -506,6 +619,22 @@ pub fn connect_vsock() -> io::Result<UnixStream> {
         return Err(io::Error::last_os_error());
     }
 
+    // Enlarge kernel socket buffers (best-effort: the kernel clamps the
+    // value to its configured max, and connecting still works either way).
+    for opt in [libc::SO_RCVBUF, libc::SO_SNDBUF] {
+        // SAFETY: fd is a valid socket from above, and we pass a pointer to
+        // a live c_int with its correct size.
+        unsafe {
+            libc::setsockopt(
+                fd,
+                libc::SOL_SOCKET,
+                opt,
+                &SOCKET_BUF_SIZE as *const libc::c_int as *const libc::c_void,
+                std::mem::size_of::<libc::c_int>() as libc::socklen_t,
+            );
+        }
+    }
+
     let addr = libc::sockaddr_vm {
         svm_family: libc::AF_VSOCK as u16,
         svm_reserved1: 0,
@@ -577,12 +706,16 @@ pub fn handle_connection(stream: UnixStream) -> io::Result<()> {
             break;
         }
 
+        // Accumulate responses from this read and send them in one write,
+        // so pipelined messages cost one syscall instead of one each
+        let mut batch: Vec<u8> = Vec::new();
+
         // n <= buf.len() is guaranteed by read()
         for msg in decoder
             .decode(buf.get(..n).unwrap_or_default())
             .map_err(to_io_error)?
         {
-            // Handle spawn_watch separately since it needs the writer Arc
+            // Handle spawn_watch and exec separately since they need the writer Arc
             let response = if msg.msg_type == MSG_SPAWN_WATCH {
                 let d = vsock_proto::decode_exec(&msg.payload).map_err(to_io_error)?;
                 Some(handle_spawn_watch(
@@ -593,17 +726,38 @@ pub fn handle_connection(stream: UnixStream) -> io::Result<()> {
                     msg.seq,
                     Arc::clone(&writer),
                 )?)
+            } else if msg.msg_type == MSG_EXEC {
+                let d = vsock_proto::decode_exec(&msg.payload).map_err(to_io_error)?;
+                // Copy out of the decode buffer so the worker thread owns its data
+                let env = d
+                    .env
+                    .iter()
+                    .map(|(k, v)| (k.to_string(), v.to_string()))
+                    .collect();
+                handle_exec_async(
+                    d.timeout_ms,
+                    d.command.to_string(),
+                    env,
+                    d.sudo,
+                    msg.seq,
+                    Arc::clone(&writer),
+                );
+                None
             } else {
                 handle_message(&msg)?
             };
 
             if let Some(response) = response {
-                // Recover from poisoned mutex: a panicked spawn_watch thread
-                // shouldn't block the main event loop from sending responses.
-                let mut w = writer.lock().unwrap_or_else(|e| e.into_inner());
-                w.write_all(&response)?;
+                batch.extend_from_slice(&response);
             }
         }
+
+        if !batch.is_empty() {
+            // Recover from poisoned mutex: a panicked spawn_watch thread
+            // shouldn't block the main event loop from sending responses.
+            let mut w = writer.lock().unwrap_or_else(|e| e.into_inner());
+            w.write_all(&batch)?;
+        }
     }
 
     log("INFO", "Host disconnected");
@@ -686,8 +840,17 @@ pub fn run(unix_socket: Option<&str>) -> io::Result<()> {
                     );
                     return Err(e);
                 }
+                // Expected disconnects (host restart, snapshot pause/resume)
+                // are routine, not warnings
+                let level = match e.kind() {
+                    io::ErrorKind::ConnectionReset
+                    | io::ErrorKind::ConnectionAborted
+                    | io::ErrorKind::BrokenPipe
+                    | io::ErrorKind::UnexpectedEof => "INFO",
+                    _ => "WARN",
+                };
                 log(
-                    "WARN",
+                    level,
                     &format!(
                         "Connection error: {}, reconnecting ({}/{})...",
                         e, attempts, MAX_RECONNECT_ATTEMPTS
@@ -737,6 +900,23 @@ mod tests {
         assert_eq!(result, "export A='1' B='2'; cmd");
     }
 
+    #[test]
+    fn read_capped_under_cap() {
+        let data = b"hello world".as_slice();
+        assert_eq!(read_capped(data), b"hello world");
+    }
+
+    #[test]
+    fn read_capped_truncates_at_cap() {
+        let data = vec![b'x'; OUTPUT_CAPTURE_CAP + 100];
+        let result = read_capped(data.as_slice());
+        assert_eq!(
+            result.len(),
+            OUTPUT_CAPTURE_CAP + OUTPUT_TRUNCATED_MARKER.len()
+        );
+        assert!(result.ends_with(OUTPUT_TRUNCATED_MARKER));
+    }
+
     #[test]
     fn prepend_env_with_special_chars() {
         let result = prepend_env("cmd", &[("KEY", "it's a \"test\"")]);
@@ -496,8 +496,11 @@ impl Decoder {
             offset += total;
         }
 
-        // Compact: remove consumed bytes once at the end
-        if offset > 0 {
+        // Compact: remove consumed bytes once at the end. The common case
+        // consumes the whole buffer, where clear() skips drain's memmove.
+        if offset == self.buf.len() {
+            self.buf.clear();
+        } else if offset > 0 {
             self.buf.drain(..offset);
         }
 
@@ -96,15 +96,17 @@ function encode(
   seq: number,
   payload: Buffer = Buffer.alloc(0),
 ): Buffer {
-  const body = Buffer.alloc(5 + payload.length);
-  body.writeUInt8(type, 0);
-  body.writeUInt32BE(seq, 1);
-  payload.copy(body, 5);
-
-  const header = Buffer.alloc(HEADER_SIZE);
-  header.writeUInt32BE(body.length, 0);
-
-  return Buffer.concat([header, body]);
+  // Single allocation: header + body written in place, every byte filled
+  const bodyLength = 5 + payload.length;
+  if (bodyLength > MAX_MESSAGE_SIZE) {
+    throw new Error(`Message too large: ${bodyLength}`);
+  }
+  const message = Buffer.allocUnsafe(HEADER_SIZE + bodyLength);
+  message.writeUInt32BE(bodyLength, 0);
+  message.writeUInt8(type, HEADER_SIZE);
+  message.writeUInt32BE(seq, HEADER_SIZE + 1);
+  payload.copy(message, HEADER_SIZE + 5);
+  return message;
 }
 
 /**
@@ -330,16 +332,30 @@ function decodeProcessExit(payload: Buffer): ProcessExitEvent {
 
 /**
  * Message decoder with buffering
+ *
+ * Tracks a read offset into the buffered data instead of re-concatenating
+ * the whole unparsed tail on every chunk. In the common case where each
+ * data event carries complete messages, incoming chunks are adopted
+ * directly with no copy at all.
  */
 class Decoder {
   private buf = Buffer.alloc(0);
+  private pos = 0;
 
   decode(data: Buffer): DecodedMessage[] {
-    this.buf = Buffer.concat([this.buf, data]);
+    if (this.pos === this.buf.length) {
+      // Everything previously buffered was consumed - adopt the new chunk
+      this.buf = data;
+      this.pos = 0;
+    } else {
+      // Partial message pending - prepend only the unconsumed tail
+      this.buf = Buffer.concat([this.buf.subarray(this.pos), data]);
+      this.pos = 0;
+    }
     const messages: DecodedMessage[] = [];
 
-    while (this.buf.length >= HEADER_SIZE) {
-      const length = this.buf.readUInt32BE(0);
+    while (this.buf.length - this.pos >= HEADER_SIZE) {
+      const length = this.buf.readUInt32BE(this.pos);
       if (length > MAX_MESSAGE_SIZE) {
         throw new Error(`Message too large: ${length}`);
       }
@@ -348,15 +364,15 @@ class Decoder {
       }
 
       const total = HEADER_SIZE + length;
-      if (this.buf.length < total) break;
+      if (this.buf.length - this.pos < total) break;
 
-      const body = this.buf.subarray(HEADER_SIZE, total);
+      const body = this.buf.subarray(this.pos + HEADER_SIZE, this.pos + total);
       const type = body.readUInt8(0);
       const seq = body.readUInt32BE(1);
       const payload = body.subarray(5);
 
       messages.push({ type, seq, payload });
-      this.buf = this.buf.subarray(total);
+      this.pos += total;
     }
     return messages;
   }